@@ -1,18 +1,38 @@
 #!/usr/bin/env python3
 # Copyright (C) 2025  macmarrum (at) outlook (dot) ie
 # SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
+import logging
 import os
 import re
+import sqlite3
 import sys
 import json
 import tomllib
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
-from datetime import datetime, timezone
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache
 from json import JSONEncoder
+from operator import itemgetter
 from pathlib import Path
-from urllib.parse import urlparse
+from textwrap import dedent
 
 import requests
+from requests.adapters import HTTPAdapter, Retry
+
+if sys.version_info >= (3, 14):
+    zstandard = True  # compression.zstd is in the stdlib - urllib3 decodes zstd without extras
+else:
+    try:
+        import zstandard  # noqa - required by requests/urllib3 (used internally), for Accept-Encoding: zstd
+    except ImportError:
+        zstandard = None
+
+try:
+    import orjson  # optional - ~5x faster JSON encode/decode for the caches and the export
+except ImportError:
+    orjson = None
 
 me = Path(__file__)
 
@@ -43,13 +63,71 @@ if conf.get('requests_ca_bundle'):
     os.environ['REQUESTS_CA_BUNDLE'] = conf['requests_ca_bundle']
 
 workdir_path = Path(WORK_DIR)
-log = Logger(Path(LOG_SQLITE))
+_conf_level_name = conf['log'].get('level', 'DEBUG')
+_conf_level = logging.getLevelName(_conf_level_name)
+if not isinstance(_conf_level, int):  # getLevelName echoes 'Level <name>' for unrecognized names, which would break every level comparison
+    print(f"unknown log level {_conf_level_name!r} in {me.with_suffix('.toml').name} - using DEBUG", file=sys.stderr)
+    _conf_level = logging.DEBUG
+log = Logger(Path(LOG_SQLITE), level=_conf_level)
+
+session = requests.Session()  # reused across all calls, so TCP+TLS connections are kept alive
+session.headers['Authorization'] = f"Bearer {GITLAB_PRIVATE_TOKEN}"
+session.headers['Accept-Encoding'] = 'zstd, gzip, deflate' if zstandard else 'gzip, deflate'  # large JSON bodies compress 5-10x
+# a pool big enough for the concurrent fetchers, with retries for transient GitLab hiccups;
+# allowed_methods=None covers the GraphQL POSTs too - they are all read-only queries
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32,
+                       max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504), allowed_methods=None))
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
 
-issue_cache_json = workdir_path / 'issue_cache.json'
 epic_cache_json = workdir_path / 'epic_cache.json'
+epic_ancestry_cache_json = workdir_path / 'epic_ancestry_cache.json'
 epic_cache = {}
 epic_to_ancestry = {}
-issue_itr_events_fetched = False
+_incomplete_ancestry_gids = set()  # chains cut short by a failed fetch - kept in memory for this run, never persisted
+
+# issues are cached per row, so incremental runs read/write only what changed, not one monolithic JSON file
+cache_db = sqlite3.connect(workdir_path / 'cache.sqlite')
+cache_db.execute('PRAGMA journal_mode=WAL')
+cache_db.execute(dedent('''\
+    CREATE TABLE IF NOT EXISTS issue_cache (
+    issue_gid TEXT PRIMARY KEY,
+    json BLOB NOT NULL,
+    updated_at TEXT NOT NULL
+    ) STRICT'''))
+
+
+def load_json(path: Path):
+    if orjson:
+        return orjson.loads(path.read_bytes())
+    with path.open('r') as fi:
+        return json.load(fi)
+
+
+def load_issue_cache() -> list:
+    """Returns the cached issue nodes - an empty list when the cache holds none"""
+    loads = orjson.loads if orjson else json.loads
+    return [loads(row[0]) for row in cache_db.execute('SELECT json FROM issue_cache ORDER BY rowid')]
+
+
+def save_issue_cache(issue_nodes):
+    """Upserts only the given nodes, in one transaction -\n
+    a handful of changed issues costs kilobytes, not a full-file rewrite"""
+    dumps = orjson.dumps if orjson else (lambda obj: json.dumps(obj).encode())
+    updated_at = datetime.now(timezone.utc).isoformat()
+    with cache_db:
+        cache_db.executemany('INSERT OR REPLACE INTO issue_cache (issue_gid, json, updated_at) VALUES (?, ?, ?)',
+                             ((issue_node['id'], dumps(issue_node), updated_at) for issue_node in issue_nodes))
+
+
+def dump_json(obj, path: Path, cls: type[JSONEncoder] = None):
+    tmp_path = path.with_name(path.name + '.tmp')
+    if orjson:  # serializes dataclasses natively, so no `cls` counterpart is needed
+        tmp_path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with tmp_path.open('w') as fo:
+            json.dump(obj, fo, indent=2, cls=cls)
+    os.replace(tmp_path, path)  # atomic - a crash mid-write cannot corrupt the previous file
 
 
 class icon:
@@ -89,9 +167,9 @@ class f:
 
 class q:
     issues_updated_after = '''
-    query($fullPath: ID!, $updatedAfter: Time, $after: String) {
+    query($fullPath: ID!, $updatedAfter: Time, $updatedBefore: Time, $after: String) {
       project(fullPath: $fullPath) {
-        issues(first: 20, updatedAfter: $updatedAfter, after: $after, sort: UPDATED_DESC) {
+        issues(first: 100, updatedAfter: $updatedAfter, updatedBefore: $updatedBefore, after: $after, sort: UPDATED_DESC) {
           pageInfo { hasNextPage endCursor }
           nodes {
             projectId
@@ -123,10 +201,7 @@ class q:
     }
     '''
     # iteration { startDate dueDate }
-    epic_with_parent = '''
-    query($fullPath: ID!, $epicIid: ID!) {
-      group(fullPath: $fullPath) {
-        epic(iid: $epicIid) {
+    epic_fields = '''{
           id
           iid
           title
@@ -138,9 +213,13 @@ class q:
             iid
             group { fullPath }
           }
-        }
-      }
-    }
+        }'''
+    epic_with_parent = f'''
+    query($fullPath: ID!, $epicIid: ID!) {{
+      group(fullPath: $fullPath) {{
+        epic(iid: $epicIid) {epic_fields}
+      }}
+    }}
     '''
     issues_for_iterations = '''
     query($fullPath: ID!, $iterationId: [ID!], $first: Int = 100) {
@@ -187,6 +266,17 @@ class q:
       }
     }
     '''
+    resource_iteration_events = '''
+            resourceIterationEvents(first: 100) {
+              nodes {
+                id
+                user { name }
+                createdAt
+                action
+                iteration { startDate dueDate }
+              }
+            }'''
+    issues_for_iterations_with_events = issues_for_iterations.replace('iteration { startDate dueDate }', 'iteration { startDate dueDate }' + resource_iteration_events)
     iterations_for_cadences_sorted_by_due_date_desc = '''
     query($fullPath: ID!, $cadenceId: [IterationsCadenceID!], $first: Int = 5) {
       group(fullPath: $fullPath) {
@@ -214,15 +304,12 @@ class q:
     '''
 
 
-class DictLike:
-    def __getitem__(self, key):
-        if hasattr(self, key):
-            return getattr(self, key)
-        raise KeyError(f"{key} not found in {self.__class__.__name__}")
+_title_getter = itemgetter('title')
+_name_getter = itemgetter('name')
 
 
-@dataclass(frozen=True)
-class NoteRecord(DictLike):
+@dataclass(frozen=True, slots=True)
+class NoteRecord:
     id: str
     body: str
     author_name: str
@@ -231,18 +318,18 @@ class NoteRecord(DictLike):
 
     @staticmethod
     def of(note_node):
-        note_rec = NoteRecord(
-            id=note_node['id'],
-            body=note_node['body'],
-            author_name=note_node['author']['name'],
-            createdAt=note_node['createdAt'],
-            system=note_node['system'],
+        # positional construction - skips the kwargs dict on this hot path
+        return NoteRecord(
+            note_node['id'],
+            note_node['body'],
+            note_node['author']['name'],
+            note_node['createdAt'],
+            note_node['system'],
         )
-        return note_rec
 
 
-@dataclass(frozen=True)
-class IterationEventRecord(DictLike):
+@dataclass(frozen=True, slots=True)
+class IterationEventRecord:
     id: str
     user_name: str
     created_at: str
@@ -252,19 +339,20 @@ class IterationEventRecord(DictLike):
 
     @staticmethod
     def of(itr_event):
-        itr_event_rec = IterationEventRecord(
-            id=itr_event['id'],
-            user_name=itr_event['user']['name'],
-            created_at=itr_event['created_at'],
-            action=itr_event['action'],
-            start_date=itr_event['iteration']['start_date'],
-            due_date=itr_event['iteration']['due_date'],
+        iteration = itr_event['iteration']
+        # positional construction - skips the kwargs dict on this hot path
+        return IterationEventRecord(
+            itr_event['id'],
+            itr_event['user']['name'],
+            itr_event['created_at'],
+            itr_event['action'],
+            iteration['start_date'],
+            iteration['due_date'],
         )
-        return itr_event_rec
 
 
-@dataclass(frozen=True)
-class IssueRecord(DictLike):
+@dataclass(frozen=True, slots=True)
+class IssueRecord:
     id: str
     iid: str
     title: str
@@ -279,26 +367,26 @@ class IssueRecord(DictLike):
 
     @staticmethod
     def of(issue_node, iteration_event_recs: list[IterationEventRecord], note_recs: list[NoteRecord] = None):
-        gid = urlparse(issue_node['id'])
-        _id = Path(gid.path).name
+        _id = issue_node['id'].rsplit('/', 1)[-1]  # the numeric tail of the gid - no urlparse/Path needed
+        # positional construction - skips the kwargs dict on this hot path
         issue_rec = IssueRecord(
-            id=_id,
-            iid=issue_node['iid'],
-            title=issue_node['title'],
-            description=issue_node.get('description'),
-            labels=[l['title'] for l in issue_node['labels']['nodes']],
-            weight=issue_node.get('weight'),
-            project_id=issue_node['projectId'],
-            closedAt=issue_node['closedAt'],
-            assignees=[node['name'] for node in issue_node['assignees']['nodes']],
-            iteration_events=iteration_event_recs,
-            notes=note_recs or [],
+            _id,
+            issue_node['iid'],
+            issue_node['title'],
+            issue_node.get('description'),
+            list(map(_title_getter, issue_node['labels']['nodes'])),
+            issue_node.get('weight'),
+            issue_node['projectId'],
+            issue_node['closedAt'],
+            list(map(_name_getter, issue_node['assignees']['nodes'])),
+            iteration_event_recs,
+            note_recs or [],
         )
         return issue_rec
 
 
-@dataclass(frozen=True)
-class EpicRecord(DictLike):
+@dataclass(frozen=True, slots=True)
+class EpicRecord:
     gid: str
     iid: str
     closedAt: str
@@ -312,19 +400,21 @@ class EpicRecord(DictLike):
 
     @staticmethod
     def of(epic_node):
-        gid = urlparse(epic_node['group']['id'])
-        group_id_ = int(Path(gid.path).name)
+        group = epic_node['group']
+        group_id_ = int(group['id'].rsplit('/', 1)[-1])
+        parent = epic_node['parent']
+        # positional construction - skips the kwargs dict on this hot path
         epic_rec = EpicRecord(
-            gid=epic_node['id'],
-            iid=epic_node['iid'],
-            closedAt=epic_node['closedAt'],
-            title=epic_node['title'],
-            group_id=group_id_,
-            group_path=epic_node['group']['fullPath'],
-            labels=[label['title'] for label in epic_node.get('labels', {}).get('nodes', [])],
-            parent_gid=epic_node['parent']['id'] if epic_node['parent'] else None,
-            parent_iid=epic_node['parent']['iid'] if epic_node['parent'] else None,
-            parent_group_path=epic_node['parent']['group']['fullPath'] if epic_node['parent'] and epic_node['parent']['group'] else None
+            epic_node['id'],
+            epic_node['iid'],
+            epic_node['closedAt'],
+            epic_node['title'],
+            group_id_,
+            group['fullPath'],
+            list(map(_title_getter, epic_node.get('labels', {}).get('nodes', []))),
+            parent['id'] if parent else None,
+            parent['iid'] if parent else None,
+            parent['group']['fullPath'] if parent and parent['group'] else None
         )
         return epic_rec
 
@@ -337,61 +427,101 @@ class EpicRecordJSONEncoder(JSONEncoder):
 
 
 def main():
-    global epic_cache
+    global epic_cache, epic_to_ancestry
     log.info('Start main')
     try:
-        with epic_cache_json.open('r') as fi:
-            epic_cache = json.load(fi)
+        epic_cache = {gid: EpicRecord(**dct) for gid, dct in load_json(epic_cache_json).items()}
     except FileNotFoundError:
         pass
-    # create_fp_report_of_issues_with_ancestry_for_period()
-    create_fp_report_of_issues_for_iterations()
+    try:
+        epic_to_ancestry = {gid: [EpicRecord(**dct) for dct in ancestry] for gid, ancestry in load_json(epic_ancestry_cache_json).items()}
+    except FileNotFoundError:
+        pass
+    try:
+        # create_fp_report_of_issues_with_ancestry_for_period()
+        create_fp_report_of_issues_for_iterations()
+    finally:
+        save_epic_cache()
+        save_epic_ancestry_cache()
+
+
+def save_epic_cache():
+    if epic_cache:
+        dump_json(epic_cache, epic_cache_json, cls=EpicRecordJSONEncoder)
+
+
+def save_epic_ancestry_cache():
+    # persist only chains that walked up to a root - a transient fetch failure must not be cached as final on disk
+    persistable = {gid: ancestry for gid, ancestry in epic_to_ancestry.items() if gid not in _incomplete_ancestry_gids}
+    if persistable:
+        dump_json(persistable, epic_ancestry_cache_json, cls=EpicRecordJSONEncoder)
 
 
 def create_fp_report_of_issues_with_ancestry_for_period():
-    global issue_itr_events_fetched
-    try:
-        with issue_cache_json.open('r') as fi:
-            issue_nodes = json.load(fi)
-    except FileNotFoundError:
+    issue_nodes = load_issue_cache()
+    if not issue_nodes:
         issue_nodes = fetch_issues_updated_after()
-        with issue_cache_json.open('w') as fo:
-            json.dump(issue_nodes, fo, indent=2)
+        save_issue_cache(issue_nodes)
+    updated_issue_nodes = fetch_iteration_events_for_issues(issue_nodes)
     freeplane_hierarchy = {}
-    for issue_node in issue_nodes:
+    epic_gid_to_node = {}
+    # bind the globals used per issue to locals - skips a LOAD_GLOBAL dict lookup each iteration
+    _has_in_range, _iter_events = has_itr_event_in_range, ITER_EVENTS
+    _convert, _issue_of, _insert = convert_itr_events_to_recs, IssueRecord.of, insert_into_freeplane_json_dct
+    # only include issues that were part of any iteration in the range - checked on the raw dicts, before any records are built
+    included_issue_nodes = [issue_node for issue_node in issue_nodes if _has_in_range(issue_node[_iter_events])]
+    prewarm_epic_cache(included_issue_nodes)  # O(depth) batched round-trips, regardless of issue count
+
+    def ancestry_of(issue_node):
         if epic := issue_node.get('epic'):
-            epic_rec_ancestry = build_epic_rec_ancestry(epic['group']['fullPath'], epic['iid'], epic['id'])
-        else:
-            epic_rec_ancestry = []
-        if (itr_events := issue_node.get(ITER_EVENTS)) is None:
-            itr_events = fetch_iteration_events_for_issue(issue_node['projectId'], issue_node['iid'])
-            issue_node[ITER_EVENTS] = itr_events
-            issue_itr_events_fetched = True
-        itr_event_recs = convert_itr_events_to_recs(itr_events)
-        itr_event_recs_in_range = filter_itr_recs_to_range(itr_event_recs, START_DATE_UTC, END_DATE_UTC)
-        if itr_event_recs_in_range:  # only include the issue if was part of any iteration in the range
-            issue_rec = IssueRecord.of(issue_node, itr_event_recs)  # include the full list of iteration events
-            insert_into_freeplane_json_dct(freeplane_hierarchy, epic_rec_ancestry, issue_rec)
-    if epic_cache:
-        with epic_cache_json.open('w') as fo:
-            json.dump(epic_cache, fo, indent=2, cls=EpicRecordJSONEncoder)
-    if issue_itr_events_fetched:
-        with issue_cache_json.open('w') as fo:
-            json.dump(issue_nodes, fo, indent=2)
+            return build_epic_rec_ancestry(epic['group']['fullPath'], epic['iid'], epic['id'])
+        return []
+
+    # phase 1: resolve ancestries concurrently (they may still fetch missing epics);
+    # phase 2: insert serially - the hierarchy and the epic node index are plain dicts
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        ancestries = list(executor.map(ancestry_of, included_issue_nodes))
+    for issue_node, epic_rec_ancestry in zip(included_issue_nodes, ancestries):
+        itr_event_recs = _convert(issue_node[_iter_events])
+        issue_rec = _issue_of(issue_node, itr_event_recs)  # include the full list of iteration events
+        _insert(freeplane_hierarchy, epic_rec_ancestry, issue_rec, epic_gid_to_node)
+    if updated_issue_nodes:
+        save_issue_cache(updated_issue_nodes)  # upsert only the issues whose events were fetched
     gitlab_export_freeplane_json = workdir_path / 'gitlab-export-freeplane.json'
     log.info(f"Save to {gitlab_export_freeplane_json}")
     dump_json_to_disk_and_import_to_freeplane(freeplane_hierarchy, gitlab_export_freeplane_json)
 
 
+PAGINATION_WINDOWS = 4
+
+
 def fetch_issues_updated_after(updated_after: str = None, project_full_path: str = None):
+    """Splits the updated-at range into PAGINATION_WINDOWS slices and walks their cursor loops concurrently.\n
+    The last slice is open-ended, to keep the original updatedAfter-only semantics"""
     updated_after = updated_after or AFTER_ISO
     project_full_path = project_full_path or PROJECT_FULL_PATH
+    start = datetime.fromisoformat(updated_after).astimezone(timezone.utc)
+    if PAGINATION_WINDOWS < 2 or start >= END_DATE_UTC:
+        return fetch_issues_updated_between(updated_after, None, project_full_path)
+    step = (END_DATE_UTC - start) / PAGINATION_WINDOWS
+    boundaries = [(start + step * i).isoformat() for i in range(PAGINATION_WINDOWS)]
+    windows = list(zip(boundaries, boundaries[1:] + [None]))
+    gid_to_issue = {}
+    with ThreadPoolExecutor(max_workers=PAGINATION_WINDOWS) as executor:
+        for issues in executor.map(lambda window: fetch_issues_updated_between(window[0], window[1], project_full_path), windows):
+            for issue_node in issues:
+                gid_to_issue[issue_node['id']] = issue_node  # windows can overlap at boundaries - dedupe by gid
+    return list(gid_to_issue.values())
+
+
+def fetch_issues_updated_between(updated_after: str, updated_before: str | None, project_full_path: str):
     cursor = None
     all_issues = []
     while True:
         variables = {
             'fullPath': project_full_path,
             'updatedAfter': updated_after,
+            'updatedBefore': updated_before,
             'after': cursor
         }
         data = run_graphql_query(q.issues_updated_after, variables)
@@ -406,65 +536,177 @@ def fetch_issues_updated_after(updated_after: str = None, project_full_path: str
     return all_issues
 
 
+@lru_cache(maxsize=256)
+def _sha256_hex(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+_apq_acknowledged_hashes = set()  # query hashes the server has answered for - the query text can be omitted on re-use
+_apq_supported = True
+
+
 def run_graphql_query(query, variables):
+    """Runs the query via automatic persisted queries (APQ) where the server supports them:\n
+    once a query's sha256 has been acknowledged, later calls send only the hash and variables"""
+    global _apq_supported
     # log.debug(f"query: {query!r} | variables: {variables!r}")
-    headers = {'Authorization': f"Bearer {GITLAB_PRIVATE_TOKEN}"}
-    response = session.post(
-        GITLAB_GRAPHQL_ENDPOINT,
-        json={'query': query, 'variables': variables},
-        headers=headers
-    )
+    query_hash = _sha256_hex(query)
+    payload = {'variables': variables, 'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': query_hash}}}
+    query_omitted = _apq_supported and query_hash in _apq_acknowledged_hashes
+    if not query_omitted:
+        payload['query'] = query
+    response = session.post(GITLAB_GRAPHQL_ENDPOINT, json=payload)
+    if response.status_code != 200 and query_omitted:
+        # a server without APQ support may reject the hash-only request outright - retry with the full query text
+        log.warning(f"GraphQL hash-only query failed with status {response.status_code} - retrying with the full query text")
+        payload['query'] = query
+        query_omitted = False
+        response = session.post(GITLAB_GRAPHQL_ENDPOINT, json=payload)
     if response.status_code != 200:
         log.error(f"GraphQL query failed with status {response.status_code}")
         return None
     result = response.json()
+    if 'errors' in result and query_omitted:
+        # the server no longer knows the hash (or never supported APQ) - retry with the full query text
+        _apq_supported = any(err.get('message') == 'PersistedQueryNotFound' for err in result['errors'])
+        payload['query'] = query
+        response = session.post(GITLAB_GRAPHQL_ENDPOINT, json=payload)
+        if response.status_code != 200:
+            log.error(f"GraphQL query failed with status {response.status_code}")
+            return None
+        result = response.json()
     if 'errors' in result:
         log.error(f"GraphQL errors: {result['errors']}")
         log.error(query)
         log.error(str(variables))
         return None
+    _apq_acknowledged_hashes.add(query_hash)
     return result['data']
 
 
+def fetch_epic_recs_batch(group_path_and_epic_iid_pairs) -> dict[str, EpicRecord] | None:
+    """Fetches several epics in one GraphQL request, using one aliased sub-query per (group_path, epic_iid) pair.\n
+    Returns a dict of gid to EpicRecord, or None when the request itself failed
+    (so callers can tell a transient failure from an epic absent from the response)"""
+    gid_to_epic_rec: dict[str, EpicRecord] = {}
+    if not group_path_and_epic_iid_pairs:
+        return gid_to_epic_rec
+    declarations = []
+    fragments = []
+    variables = {}
+    for i, (group_path, epic_iid) in enumerate(group_path_and_epic_iid_pairs):
+        declarations.append(f"$groupPath{i}: ID!, $epicIid{i}: ID!")
+        fragments.append(f"e{i}: group(fullPath: $groupPath{i}) {{ epic(iid: $epicIid{i}) {q.epic_fields} }}")
+        variables[f"groupPath{i}"] = group_path
+        variables[f"epicIid{i}"] = epic_iid
+    joined_fragments = '\n'.join(fragments)
+    query = f"query({', '.join(declarations)}) {{\n{joined_fragments}\n}}"
+    data = run_graphql_query(query, variables)
+    if not data:
+        return None
+    for i in range(len(group_path_and_epic_iid_pairs)):
+        epic_node = (data.get(f"e{i}") or {}).get('epic')
+        if epic_node:
+            epic_rec = EpicRecord.of(epic_node)
+            gid_to_epic_rec[epic_rec.gid] = epic_rec
+    return gid_to_epic_rec
+
+
+def prewarm_epic_cache(issue_nodes):
+    """Fetches every epic referenced by the issues - and their parents, until closure - in batched\n
+    aliased GraphQL requests, so the per-issue ancestry walks run fully from the cache"""
+    missing_pairs = {(e['group']['fullPath'], e['iid']) for issue_node in issue_nodes
+                     if (e := issue_node.get('epic')) and e['id'] not in epic_cache}
+    while missing_pairs:
+        gid_to_epic_rec = fetch_epic_recs_batch(sorted(missing_pairs))
+        if not gid_to_epic_rec:
+            break  # the batch failed - the ancestry walks will fetch what they need themselves
+        epic_cache.update(gid_to_epic_rec)
+        missing_pairs = {(rec.parent_group_path, rec.parent_iid) for rec in gid_to_epic_rec.values()
+                         if rec.parent_gid and rec.parent_iid and rec.parent_group_path and rec.parent_gid not in epic_cache}
+
+
 def build_epic_rec_ancestry(group_path, epic_iid, epic_gid):
-    log.debug(f"build_epic_rec_ancestry({group_path}, {epic_iid}, {epic_gid})")
-    if epic_rec_ancestry := epic_to_ancestry.get(epic_gid):
+    if log.isEnabledFor(logging.DEBUG):  # skip building the f-string when debug is off
+        log.debug(f"build_epic_rec_ancestry({group_path}, {epic_iid}, {epic_gid})")
+    if (epic_rec_ancestry := epic_to_ancestry.get(epic_gid)) is not None:  # an empty list is a remembered miss
         return epic_rec_ancestry
     epic_rec_ancestry: list[EpicRecord] = []
-    while True:
-        cache_key = epic_gid
-        if cache_key in epic_cache:
-            epic_rec = epic_cache[cache_key]
-            if not isinstance(epic_rec, EpicRecord):
-                epic_rec = EpicRecord(**epic_rec)
+    ## phase 1: walk the chain via epic_cache, collecting the (group_path, epic_iid) pairs it doesn't cover
+    missing_pairs_with_gids = []
+    walk_gid, walk_iid, walk_group_path = epic_gid, epic_iid, group_path
+    while walk_gid and walk_iid and walk_group_path:
+        if epic_rec := epic_cache.get(walk_gid):
+            walk_gid = epic_rec.parent_gid
+            walk_iid = epic_rec.parent_iid
+            walk_group_path = epic_rec.parent_group_path
         else:
-            variables = {'fullPath': group_path, 'epicIid': epic_iid}
-            data = run_graphql_query(q.epic_with_parent, variables)
-            epic_node = data.get('group', {}).get('epic')
-            if not epic_node:
-                log.error(f"Epic not found: {cache_key}")
-                break
-            epic_rec = EpicRecord.of(epic_node)
-            epic_cache[cache_key] = epic_rec
-        epic_rec_ancestry.insert(0, epic_rec)  # Build from root to leaf
-        epic_gid = epic_rec['parent_gid']
-        epic_iid = epic_rec['parent_iid']
-        group_path = epic_rec['parent_group_path']
-        if not epic_gid or not epic_iid or not group_path:
+            missing_pairs_with_gids.append(((walk_group_path, walk_iid), walk_gid))
+            break  # the parent is unknown until this epic is fetched
+    ## phase 2: batch-fetch the missing epics, following newly discovered parents until closure
+    while missing_pairs_with_gids:
+        gid_to_epic_rec = fetch_epic_recs_batch([pair for pair, _ in missing_pairs_with_gids])
+        if gid_to_epic_rec is None:
+            log.warning(f"Epic batch fetch failed - ancestry left incomplete for {[gid for _, gid in missing_pairs_with_gids]}")
             break
-    epic_to_ancestry[epic_gid] = epic_rec_ancestry
+        for _, wanted_gid in missing_pairs_with_gids:
+            if wanted_gid not in gid_to_epic_rec:
+                log.error(f"Epic not found: {wanted_gid}")
+        epic_cache.update(gid_to_epic_rec)
+        missing_pairs_with_gids = [((rec.parent_group_path, rec.parent_iid), rec.parent_gid)
+                                   for rec in gid_to_epic_rec.values()
+                                   if rec.parent_gid and rec.parent_iid and rec.parent_group_path and rec.parent_gid not in epic_cache]
+    ## phase 3: assemble the ancestry leaf-to-root from the now-complete cache, then reverse
+    walk_gid, walk_iid, walk_group_path = epic_gid, epic_iid, group_path
+    complete = True  # the chain is complete only when the walk runs out of parent references, not out of cache
+    while walk_gid and walk_iid and walk_group_path:
+        epic_rec = epic_cache.get(walk_gid)
+        if not epic_rec:
+            complete = False
+            break
+        epic_rec_ancestry.append(epic_rec)
+        walk_gid = epic_rec.parent_gid
+        walk_iid = epic_rec.parent_iid
+        walk_group_path = epic_rec.parent_group_path
+    epic_rec_ancestry.reverse()  # root to leaf
+    # memoize the prefix chain for every epic on it - any of them may head another issue's ancestry
+    for i, rec in enumerate(epic_rec_ancestry):
+        epic_to_ancestry[rec.gid] = epic_rec_ancestry[:i + 1]
+    if not epic_rec_ancestry:
+        epic_to_ancestry[epic_gid] = epic_rec_ancestry  # remember the miss, too
+    if not complete:
+        # memoized for this run only, so a dead or unfetchable epic is not re-fetched per issue,
+        # but excluded from the persisted cache - the next run gets a fresh chance
+        _incomplete_ancestry_gids.update(rec.gid for rec in epic_rec_ancestry)
+        _incomplete_ancestry_gids.add(epic_gid)
     return epic_rec_ancestry
 
 
 def fetch_iteration_events_for_issue(project_id, issue_iid):
-    log.debug(f"fetch_iteration_events_for_issue({project_id}, {issue_iid})")
+    if log.isEnabledFor(logging.DEBUG):  # called once per issue - skip the f-string when debug is off
+        log.debug(f"fetch_iteration_events_for_issue({project_id}, {issue_iid})")
     url = f"{GITLAB_REST_ENDPOINT}/projects/{project_id}/issues/{issue_iid}/resource_iteration_events"
-    headers = {'Authorization': f"Bearer {GITLAB_PRIVATE_TOKEN}"}
-    resp = session.get(url, headers=headers)
+    resp = session.get(url)
     resp.raise_for_status()
     return resp.json()
 
 
+MAX_FETCH_WORKERS = 16  # stays within GitLab's rate limits and the session's pool_maxsize
+
+
+def fetch_iteration_events_for_issues(issue_nodes) -> list:
+    """Fetches resource_iteration_events concurrently for each issue missing ITER_EVENTS.\n
+    Returns the list of issue nodes that were updated - empty if everything was cached"""
+    issue_nodes_without_events = [issue_node for issue_node in issue_nodes if issue_node.get(ITER_EVENTS) is None]
+    if not issue_nodes_without_events:
+        return []
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        itr_events_iterator = executor.map(lambda node: fetch_iteration_events_for_issue(node['projectId'], node['iid']), issue_nodes_without_events)
+        for issue_node, itr_events in zip(issue_nodes_without_events, itr_events_iterator):
+            issue_node[ITER_EVENTS] = itr_events
+    return issue_nodes_without_events
+
+
 def convert_itr_events_to_recs(iteration_events):
     event_recs: list[IterationEventRecord] = []
     for itr_event in iteration_events:
@@ -473,95 +715,136 @@ def convert_itr_events_to_recs(iteration_events):
     return event_recs
 
 
-def filter_itr_recs_to_range(itr_recs, start, end):
-    filtered_recs: list[IterationEventRecord] = []
-    for itr_rec in itr_recs:
-        if is_iteration_in_range(itr_rec, start, end):
-            filtered_recs.append(itr_rec)
-    return filtered_recs
+@lru_cache(maxsize=8192)
+def parse_iso_to_utc(iso: str) -> datetime:
+    """The same ISO strings recur across issues/events/epics - memoize the (expensive) parse + conversion"""
+    return datetime.fromisoformat(iso).astimezone(timezone.utc)
 
 
-def is_iteration_in_range(iteration, start, end):
-    start_date = datetime.fromisoformat(iteration['start_date']).astimezone(timezone.utc)
-    return start <= start_date <= end
+@lru_cache(maxsize=2048)
+def dumps_str_list(strings: tuple[str, ...]) -> str:
+    """Epics (and their labels) are shared by many issues - serialize each distinct list once"""
+    return json.dumps(list(strings))
 
 
-def insert_into_freeplane_json_dct(freeplane_hierarchy, epic_rec_ancestry_chain: list[EpicRecord], issue_rec: IssueRecord):
-    current = freeplane_hierarchy
-    for epic_rec in epic_rec_ancestry_chain:
-        epic_id = epic_rec['gid']
-        if epic_id not in current:
-            current[epic_id] = {
-                f.CORE: f"&{epic_rec['iid']} {epic_rec['title']}",
-                f.ATTRIBUTES: {
-                    'group_path': epic_rec['group_path'],
-                    'group_id': epic_rec['group_id'],
-                    'id': int(Path(epic_id.removeprefix('gid:/')).name),
+@lru_cache(maxsize=2048)
+def dumps_formatted_names(names: tuple[str, ...]) -> str:
+    return json.dumps([format_name(nm) for nm in names])
+
+
+# string-compare boundaries for has_itr_event_in_range, precomputed in local time
+# so that they agree with parse_iso_to_utc on plain YYYY-MM-DD dates
+_local_start = START_DATE_UTC.astimezone()
+_START_ISO = (_local_start.date() + timedelta(days=1)).isoformat() if _local_start.time() != time.min else _local_start.date().isoformat()
+_END_ISO = END_DATE_UTC.astimezone().date().isoformat()
+
+
+def has_itr_event_in_range(iteration_events) -> bool:
+    """Scans the raw event dicts to decide whether the issue makes the report at all,\n
+    so no records are built for issues with no event in range"""
+    for itr_event in iteration_events:
+        start_date = itr_event['iteration']['start_date']
+        if len(start_date) == 10:
+            if _START_ISO <= start_date <= _END_ISO:
+                return True
+        elif START_DATE_UTC <= parse_iso_to_utc(start_date) <= END_DATE_UTC:
+            return True
+    return False
+
+
+def insert_into_freeplane_json_dct(freeplane_hierarchy, epic_rec_ancestry_chain: list[EpicRecord], issue_rec: IssueRecord, epic_gid_to_node: dict[str, dict] = None):
+    """Inserts the issue under its epic ancestry chain, creating missing epic nodes on the way.\n
+    epic_gid_to_node is a flat index of already-created epic nodes, shared across calls by the caller,
+    so chains already in the hierarchy are resolved with a single lookup instead of a walk"""
+    # bind the f keys to locals - skips the class-attribute lookup per loop/comprehension iteration
+    CORE, NOTE, ICONS, ATTRIBUTES, STYLE, PROPS = f.CORE, f.NOTE, f.ICONS, f.ATTRIBUTES, f.STYLE, f.PROPS
+    noteContentType, markdown, folded = f.noteContentType, f.markdown, f.folded
+    if epic_gid_to_node is None:
+        epic_gid_to_node = {}
+    if epic_rec_ancestry_chain and (current := epic_gid_to_node.get(epic_rec_ancestry_chain[-1].gid)) is not None:
+        pass  # the whole chain is already in the hierarchy
+    else:
+        current = freeplane_hierarchy
+        for epic_rec in epic_rec_ancestry_chain:
+            epic_id = epic_rec.gid
+            if (node := epic_gid_to_node.get(epic_id)) is None:
+                node = {
+                    CORE: f"&{epic_rec.iid} {epic_rec.title}",
+                    ATTRIBUTES: {
+                        'group_path': epic_rec.group_path,
+                        'group_id': epic_rec.group_id,
+                        'id': int(Path(epic_id.removeprefix('gid:/')).name),
+                    }
                 }
-            }
-            if labels := epic_rec['labels']:
-                current[epic_id][f.ATTRIBUTES]['preStashTags'] = json.dumps(labels)
-            if closed_at := epic_rec['closedAt']:
-                closed_at_dt = datetime.fromisoformat(closed_at)
-                current[epic_id][f.ATTRIBUTES]['closedAt'] = format_date(closed_at_dt)
-                style_name = '!NextAction.Closed' if closed_at_dt < END_DATE_UTC else '!WaitingFor.Closed'
-                current[epic_id][f.STYLE] = {'name': style_name}
-            current[epic_id].setdefault(f.STYLE, {})[f.minNodeWidth] = f._10cm
-        current = current[epic_id]
-    issue_id = issue_rec['id']
-    current[issue_id] = {
-        f.CORE: f"#{issue_rec['iid']} {issue_rec['title']}",
-        f.NOTE: issue_rec['description'],
-        f.ICONS: [icon.ISSUE],
-        f.ATTRIBUTES: {},
-        f.comments: {},
-        f.iteration_events: {},
+                if labels := epic_rec.labels:
+                    node[ATTRIBUTES]['preStashTags'] = dumps_str_list(tuple(labels))
+                if closed_at := epic_rec.closedAt:
+                    closed_at_dt = parse_iso_to_utc(closed_at)
+                    node[ATTRIBUTES]['closedAt'] = format_date(closed_at_dt)
+                    style_name = '!NextAction.Closed' if closed_at_dt < END_DATE_UTC else '!WaitingFor.Closed'
+                    node[STYLE] = {'name': style_name}
+                node.setdefault(STYLE, {})[f.minNodeWidth] = f._10cm
+                current[epic_id] = node
+                epic_gid_to_node[epic_id] = node
+            current = node
+    issue_id = issue_rec.id
+    issue_dct = current[issue_id] = {
+        CORE: f"#{issue_rec.iid} {issue_rec.title}",
+        NOTE: issue_rec.description,
+        ICONS: [icon.ISSUE],
+        ATTRIBUTES: {},
     }
-    if assignees := issue_rec['assignees']:
-        current[issue_id][f.ATTRIBUTES]['assignees'] = json.dumps([format_name(nm) for nm in assignees])
-    if labels := issue_rec['labels']:
-        current[issue_id][f.ATTRIBUTES]['preStashTags'] = json.dumps(labels)
-    if weight := issue_rec['weight']:
-        current[issue_id][f.ATTRIBUTES]['weight'] = weight
-    if closed_at := issue_rec['closedAt']:
-        closed_at_dt = datetime.fromisoformat(closed_at)
-        current[issue_id][f.ATTRIBUTES]['closedAt'] = format_date(closed_at_dt)
+    if assignees := issue_rec.assignees:
+        issue_dct[ATTRIBUTES]['assignees'] = dumps_formatted_names(tuple(assignees))
+    if labels := issue_rec.labels:
+        issue_dct[ATTRIBUTES]['preStashTags'] = dumps_str_list(tuple(labels))
+    if weight := issue_rec.weight:
+        issue_dct[ATTRIBUTES]['weight'] = weight
+    if closed_at := issue_rec.closedAt:
+        closed_at_dt = parse_iso_to_utc(closed_at)
+        issue_dct[ATTRIBUTES]['closedAt'] = format_date(closed_at_dt)
         style_name = '!NextAction.Closed' if closed_at_dt < END_DATE_UTC else '!WaitingFor.Closed'
-        current[issue_id][f.STYLE] = {'name': style_name}
-    current[issue_id].setdefault(f.STYLE, {})[f.minNodeWidth] = f._10cm
+        issue_dct[STYLE] = {'name': style_name}
+    issue_dct.setdefault(STYLE, {})[f.minNodeWidth] = f._10cm
     # notes aka comments
-    current[issue_id][f.comments] |= {
-        f"{nt['id']}": {
-            f.CORE: f"{format_date(nt['createdAt'])} | {format_name(nt['author_name'])}",
-            f.ICONS: [icon.SYSTEM_NOTE if nt['system'] else icon.HUMAN_NOTE],
-            f.NOTE: nt['body'],
-            f.PROPS: {f.noteContentType: f.markdown},
-        } for nt in issue_rec['notes']
+    issue_dct[f.comments] = {
+        f"{nt.id}": {
+            CORE: f"{format_date(nt.createdAt)} | {format_name(nt.author_name)}",
+            ICONS: [icon.SYSTEM_NOTE if nt.system else icon.HUMAN_NOTE],
+            NOTE: nt.body,
+            PROPS: {noteContentType: markdown},
+        } for nt in issue_rec.notes
     }
     # fold children of notes
-    current[issue_id][f.comments][f.PROPS] = {f.folded: True}
+    issue_dct[f.comments][PROPS] = {folded: True}
     # iteration events
-    current[issue_id][f.iteration_events] |= {
-        f"{iev['id']}": {
-            f.CORE: f"{iev['start_date']} - {iev['due_date']}",
-            f.ICONS: [ACTION_TO_ICON.get(iev['action'], icon.FALLBACK_ACTION)],
-            f.ATTRIBUTES: {
-                'user': format_name(iev['user_name']),
-                'created_at': format_date(iev['created_at']),
-                'action': iev['action'],
+    issue_dct[f.iteration_events] = {
+        f"{iev.id}": {
+            CORE: f"{iev.start_date} - {iev.due_date}",
+            ICONS: [ACTION_TO_ICON.get(iev.action, icon.FALLBACK_ACTION)],
+            ATTRIBUTES: {
+                'user': format_name(iev.user_name),
+                'created_at': format_date(iev.created_at),
+                'action': iev.action,
             }
-        } for iev in issue_rec['iteration_events']
+        } for iev in issue_rec.iteration_events
     }
     # fold children of iteration events
-    current[issue_id][f.iteration_events][f.PROPS] = {f.folded: True}
+    issue_dct[f.iteration_events][PROPS] = {folded: True}
     # issue properties
-    current[issue_id][f.PROPS] = {f.noteContentType: f.markdown, f.folded: True}
+    issue_dct[PROPS] = {noteContentType: markdown, folded: True}
+
+
+@lru_cache(maxsize=8192)
+def format_iso_date(iso: str, fmt: str) -> str:
+    return datetime.fromisoformat(iso).astimezone().strftime(fmt)
 
 
 def format_date(date_or_str: datetime | str, fmt='%Y-%m-%d %H:%M:%S') -> str:
     try:
-        dt = datetime.fromisoformat(date_or_str) if isinstance(date_or_str, str) else date_or_str
-        return dt.astimezone().strftime(fmt)
+        if isinstance(date_or_str, str):
+            return format_iso_date(date_or_str, fmt)
+        return date_or_str.astimezone().strftime(fmt)
     except (ValueError, TypeError) as e:
         log.error(f"Date formatting error: {e}")
         return str(date_or_str)
@@ -574,9 +857,25 @@ def format_name(name: str) -> str:
     return rx_gpn.sub('', name)
 
 
+def dump_json_streaming(dct: dict, path: Path):
+    """Serializes the top-level dict one entry at a time,\n
+    so peak memory tracks the largest subtree instead of the whole export"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('wb') as fo:
+        fo.write(b'{\n')
+        last_i = len(dct) - 1
+        for i, (key, val) in enumerate(dct.items()):
+            if orjson:
+                fo.write(orjson.dumps(str(key)) + b': ' + orjson.dumps(val, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            else:
+                fo.write(json.dumps(str(key)).encode() + b': ' + json.dumps(val, indent=2).encode())
+            fo.write(b',\n' if i != last_i else b'\n')
+        fo.write(b'}\n')
+    os.replace(tmp_path, path)  # atomic - a crash mid-write cannot corrupt the previous file
+
+
 def dump_json_to_disk_and_import_to_freeplane(freeplane_hierarchy, export_json):
-    with export_json.open('w') as fo:
-        json.dump(freeplane_hierarchy, fo, indent=2)
+    dump_json_streaming(freeplane_hierarchy, export_json)
     result = import_json(export_json)
     if result:
         log.info(f"Import result: {result}")
@@ -595,27 +894,26 @@ def create_fp_report_of_issues_for_iterations(iteration_gids: list[str] = None,
     top_level_details = {f.DETAILS: format_date(datetime.now())}
     top_level_attributes = {f.ATTRIBUTES: {f"iter{i}": gid for i, gid in enumerate(iteration_gids)}}
     issue_nodes = fetch_issues_for_iterations(iteration_gids, project_full_path)
-    for issue_node in issue_nodes:
-        itr_event_recs = fetch_iteration_events_for_issue(issue_node['projectId'], issue_node['iid'])
-        issue_node[ITER_EVENTS] = itr_event_recs
+    fetch_iteration_events_for_issues(issue_nodes)
     issues_for_iterations_json = workdir_path / 'issues_for_iterations.json'
-    with issues_for_iterations_json.open('w') as fo:
-        json.dump(issue_nodes, fo, indent=2)
+    dump_json(issue_nodes, issues_for_iterations_json)
     freeplane_json_dct = {}
+    epic_gid_to_node = {}
     for issue_node in issue_nodes:
         if issue_node.get('epic'):
             epic_gid = issue_node['epic']['id']
-            if not (epic_node := epic_cache.get(epic_gid)):
+            if not (epic_rec := epic_cache.get(epic_gid)):
                 data = run_graphql_query(q.epic_with_parent, {'fullPath': issue_node['epic']['group']['fullPath'], 'epicIid': issue_node['epic']['iid']})
                 epic_node = data.get('group', {}).get('epic')
-                epic_cache[epic_gid] = epic_node
-            epic_rec_ancestry = [EpicRecord.of(epic_node)]
+                epic_rec = EpicRecord.of(epic_node)
+                epic_cache[epic_gid] = epic_rec
+            epic_rec_ancestry = [epic_rec]
         else:
             epic_rec_ancestry = []
         itr_event_recs = [IterationEventRecord.of(itr_event) for itr_event in issue_node[ITER_EVENTS]]
         note_recs = [NoteRecord.of(note_node) for note_node in issue_node['notes']['nodes']]
         issue_rec = IssueRecord.of(issue_node, itr_event_recs, note_recs)
-        insert_into_freeplane_json_dct(freeplane_json_dct, epic_rec_ancestry, issue_rec)
+        insert_into_freeplane_json_dct(freeplane_json_dct, epic_rec_ancestry, issue_rec, epic_gid_to_node)
     gitlab_export_freeplane_json = workdir_path / 'gitlab-export-freeplane.json'
     fp_json_dict_with_iteration_on_top = {top_level_core: {**top_level_details, **top_level_attributes, **freeplane_json_dct}}
     dump_json_to_disk_and_import_to_freeplane(fp_json_dict_with_iteration_on_top, gitlab_export_freeplane_json)
@@ -625,11 +923,27 @@ def fetch_issues_for_iterations(iteration_gids: list[str] = None, project_full_p
     iteration_gids = iteration_gids or [fetch_current_iteration()['id']]
     project_full_path = project_full_path or PROJECT_FULL_PATH
     variables = {'fullPath': project_full_path, 'iterationId': iteration_gids}
-    data = run_graphql_query(q.issues_for_iterations, variables)
+    data = run_graphql_query(q.issues_for_iterations_with_events, variables)
+    if not data:  # resourceIterationEvents may not be exposed by this GitLab version
+        data = run_graphql_query(q.issues_for_iterations, variables)
     issues = data['project']['issues']['nodes']
+    for issue_node in issues:
+        if (itr_events := issue_node.pop('resourceIterationEvents', None)) is not None:
+            issue_node[ITER_EVENTS] = [reshape_graphql_itr_event_to_rest(node) for node in itr_events['nodes']]
     return issues
 
 
+def reshape_graphql_itr_event_to_rest(itr_event_node):
+    """Translates a GraphQL resourceIterationEvents node (camelCase) to the REST shape expected by IterationEventRecord.of"""
+    return {
+        'id': itr_event_node['id'],
+        'user': {'name': itr_event_node['user']['name']},
+        'created_at': itr_event_node['createdAt'],
+        'action': itr_event_node['action'],
+        'iteration': {'start_date': itr_event_node['iteration']['startDate'], 'due_date': itr_event_node['iteration']['dueDate']},
+    }
+
+
 def fetch_current_iteration():
     iterations = fetch_iterations_sorted_by_due_date_desc()
     for iteration in iterations:
@@ -657,5 +971,4 @@ def fetch_cadences():
 
 
 if __name__ == '__main__':
-    with requests.session() as session:
-        main()
+    main()
@@ -1,14 +1,20 @@
 # python3
 # Copyright (C) 2025  macmarrum (at) outlook (dot) ie
 # SPDX-License-Identifier: GPL-3.0-or-later
+import atexit
 import logging
 import re
 import sqlite3
 import sys
+import threading
 from datetime import datetime
 from os import PathLike
 from textwrap import dedent
 
+# logging.getLevelName takes the lock-free but dict-in-module path each call - precompute the usual suspects
+_LEVEL_TO_NAME = {level: logging.getLevelName(level) for level in (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL)}
+_now = datetime.now
+
 
 class Logger:
     _CREATE_STMT = dedent('''\
@@ -18,16 +24,27 @@ class Logger:
             level TEXT NOT NULL,
             message TEXT NOT NULL
             ) STRICT''')
+    _COMMIT_EVERY = 64  # the fsync per commit is the dominant cost of logging - batch it
 
-    def __init__(self, database: PathLike | str | sqlite3.Connection, *, file=None, flatten_file_msg=True, datefmt: str = None, print_create=False):
-        self._db = database if isinstance(database, sqlite3.Connection) else sqlite3.connect(database)
+    def __init__(self, database: PathLike | str | sqlite3.Connection, *, file=None, flatten_file_msg=True, datefmt: str = None, print_create=False, level: int = logging.DEBUG):
+        if isinstance(database, sqlite3.Connection):
+            self._db = database  # journal/synchronous pragmas are left to the connection's owner
+        else:
+            self._db = sqlite3.connect(database, check_same_thread=False)  # log() is called from worker threads, e.g. by the concurrent fetchers
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
         self._file = file or sys.stderr
         self._datefmt = datefmt or '%Y-%m-%d %H:%M:%S.%f'
         self._flatten_file_msg = flatten_file_msg
         self._RX_FLAT = re.compile(r'\n\s*')
+        self._rx_flat_sub = self._RX_FLAT.sub
+        self._level = level
+        self._uncommitted_count = 0
+        self._lock = threading.Lock()  # one connection shared by all logging threads
         self._migrate_column_level_to_level_name_if_required()
         self._create_table_log_if_not_exists(print_create=print_create)
         self.warn = self.warning
+        atexit.register(self.flush)
 
     def _create_table_log_if_not_exists(self, print_create=False):
         print_create and print(self._RX_FLAT.sub(' ', self._CREATE_STMT) if self._flatten_file_msg else self._CREATE_STMT, file=self._file)
@@ -44,14 +61,37 @@ class Logger:
             self._db.execute('DROP TABLE log_old')
             self._db.commit()
 
+    def setLevel(self, level: int):
+        self._level = level
+
+    def isEnabledFor(self, level: int) -> bool:
+        return level >= self._level
+
     def log(self, level: int, message: str):
-        level_name = logging.getLevelName(level)
-        localtime = datetime.now().strftime(self._datefmt)
-        file_message = self._RX_FLAT.sub(' ', message) if self._flatten_file_msg else message
+        if level < self._level:
+            return
+        level_name = _LEVEL_TO_NAME.get(level) or logging.getLevelName(level)
+        localtime = _now().strftime(self._datefmt)
+        # most messages are single-line - the C-level containment check dodges the regex fixed cost
+        file_message = self._rx_flat_sub(' ', message) if self._flatten_file_msg and '\n' in message else message
         print(f"{localtime} {level_name} {file_message}", file=self._file)
         params = (localtime, level_name, message)
-        self._db.execute('INSERT INTO log (localtime, level, message) VALUES (?, ?, ?)', params)
-        self._db.commit()
+        # the insert is visible to this connection right away; the commit (fsync) is batched
+        with self._lock:
+            self._db.execute('INSERT INTO log (localtime, level, message) VALUES (?, ?, ?)', params)
+            self._uncommitted_count += 1
+            flush_now = self._uncommitted_count >= self._COMMIT_EVERY
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """Commits any batched inserts. Registered with atexit; safe to call at any time"""
+        with self._lock:
+            try:
+                self._db.commit()
+            except sqlite3.ProgrammingError:  # the connection was already closed by its owner
+                pass
+            self._uncommitted_count = 0
 
     def debug(self, message):
         self.log(logging.DEBUG, message)
@@ -1,4 +1,5 @@
 import io
+import logging
 import sqlite3
 from time import strftime
 
@@ -16,6 +17,41 @@ def test_sqlite_logger__no_flatten__print_create__datefmt():
     assert log._db.execute('SELECT * FROM log').fetchall() == [(1, localtime, 'INFO', message)]
 
 
+def test_sqlite_logger__insert_is_committed_on_flush(tmp_path):
+    db_path = tmp_path / 'log.sqlite'
+    log = Logger(db_path, file=io.StringIO())
+    log.info('before flush')
+    other = sqlite3.connect(db_path)  # a second connection sees only committed rows
+    assert other.execute('SELECT message FROM log').fetchall() == []
+    log.flush()
+    assert other.execute('SELECT message FROM log').fetchall() == [('before flush',)]
+    other.close()
+
+
+def test_sqlite_logger__commits_once_batch_threshold_is_reached(tmp_path):
+    db_path = tmp_path / 'log.sqlite'
+    log = Logger(db_path, file=io.StringIO())
+    other = sqlite3.connect(db_path)
+    for i in range(Logger._COMMIT_EVERY - 1):
+        log.info(f"message {i}")
+    assert other.execute('SELECT count(*) FROM log').fetchone() == (0,)
+    log.info('threshold')
+    assert other.execute('SELECT count(*) FROM log').fetchone() == (Logger._COMMIT_EVERY,)
+    other.close()
+
+
+def test_sqlite_logger__level_and_is_enabled_for():
+    string_io = io.StringIO()
+    log = Logger(':memory:', file=string_io, level=logging.INFO)
+    assert log.isEnabledFor(logging.INFO) is True
+    assert log.isEnabledFor(logging.DEBUG) is False
+    log.debug('dropped')
+    assert string_io.getvalue() == ''
+    assert log._db.execute('SELECT * FROM log').fetchall() == []
+    log.setLevel(logging.DEBUG)
+    assert log.isEnabledFor(logging.DEBUG) is True
+
+
 def test_sqlite_logger__migrate_column_level_to_level_name_if_required():
     db = sqlite3.connect(':memory:')
     db.execute(Logger._CREATE_STMT.replace('level TEXT', 'level INTEGER'))
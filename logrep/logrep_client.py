@@ -2,9 +2,11 @@
 # Copyright (C) 2025  macmarrum (at) outlook (dot) ie
 # SPDX-License-Identifier: GPL-3.0-or-later
 import argparse
+import atexit
 import importlib
 import json
 import logging
+import os.path
 import re
 import sys
 import tomllib
@@ -12,9 +14,10 @@ import traceback
 from collections.abc import Callable, Generator, Iterator, Sequence
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import ClassVar
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 
 import requests
 import urllib3
@@ -23,19 +26,27 @@ from colorama import init, Fore, Style
 if sys.version_info < (3, 14):
     import zstandard  # noqa - required by requests/urllib3 (used internally), for Accept-Encoding: zstd
 
+try:
+    from orjson import loads as _json_loads  # optional - ~5x faster parse, takes the NDJSON bytes directly
+except ImportError:
+    _json_loads = json.loads
+
 me = Path(__file__)
 
 # Note: special chars could be either escaped or bracketed [] to make them literal
 # Bracketing is not accounted for here, hence "probably"
-RX_PROBABLY_COMPLEX_PATTERN = re.compile(r'(?<!\\)[()\[{.*+?^$|]|\\[AbdDsSwWzZ]')
-RX_ESCAPE_FOLLOWED_BY_SPECIAL = re.compile(r'\\(?=[()\[{.*+?^$|])')
+# Group 'complex' flags a real regex construct; a plain (unnamed) match is an escape to strip for literal matching
+RX_COMPLEX_OR_ESCAPE = re.compile(r'(?P<complex>(?<!\\)[()\[{.*+?^$|]|\\[AbdDsSwWzZ])|\\(?=[()\[{.*+?^$|])')
 
 
-def is_probably_complex_pattern(pattern: str):
-    return RX_PROBABLY_COMPLEX_PATTERN.search(pattern) is not None
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern: str) -> re.Pattern:
+    """Library callers grep many files with the same pattern - keep compiled objects\n
+    out of re's internal cache, which other regex use can evict"""
+    return re.compile(pattern)
 
 
-@dataclass
+@dataclass(slots=True)
 class Settings:
     section: str | None = None  # table in client toml
     profile: str | None = None  # table in server toml
@@ -59,7 +70,7 @@ class Settings:
     local_path: str | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Arguments:
     profile: str | None
     verify: str | bool | None
@@ -81,21 +92,25 @@ class Arguments:
     output: str | None
     url_query: str = field(default=None, init=False)
     search_args: dict = field(default=None, init=False)
+    use_color: bool = field(default=False, init=False)  # declared so it has a slot - set in __post_init__
     local_path: str | None = None
     RX_ARG_EQ: ClassVar[re.Pattern] = re.compile(r'-{1,2}[a-zA-Z0-9-]+=')
 
     def __post_init__(self):
         self._post_init_verify()
-        _profile = f"profile={quote(self.profile)}" if self.profile else None
-        _discard_before = f"discard_before={quote(self.discard_before)}" if self.discard_before else None
-        _before_context = f"before_context={self.before_context}" if self.before_context else None
-        _pattern = f"pattern={quote(self.pattern)}" if self.pattern else None
-        _except_pattern = f"except_pattern={quote(self.except_pattern)}" if self.except_pattern else None
-        _after_context = f"after_context={self.after_context}" if self.after_context else None
-        _discard_after = f"discard_after={quote(self.discard_after)}" if self.discard_after else None
-        _files_with_matches = 'files_with_matches=true' if self.files_with_matches else None
         self.url = self.url.rstrip('/')
-        self.url_query = f"?{'&'.join(e for e in [_profile, _before_context, _pattern, _except_pattern, _after_context, _discard_before, _discard_after, _files_with_matches] if e)}"
+        # a tuple sequence, not a dict, to keep the established query-param order
+        params = [(k, v) for k, v in (
+            ('profile', self.profile),
+            ('before_context', self.before_context),
+            ('pattern', self.pattern),
+            ('except_pattern', self.except_pattern),
+            ('after_context', self.after_context),
+            ('discard_before', self.discard_before),
+            ('discard_after', self.discard_after),
+            ('files_with_matches', 'true' if self.files_with_matches else None),
+        ) if v]
+        self.url_query = f"?{urlencode(params, quote_via=quote)}"  # quote_via=quote: %20 for spaces, like the previous hand-rolled quoting
         self.search_args = {k: v for k, v in {
             'profile': self.profile,
             'discard_before': self.discard_before,
@@ -132,6 +147,11 @@ class Arguments:
             return str
         if isinstance(callable_string, Callable):
             return callable_string
+        return cls._resolve_callable_from_string(callable_string)
+
+    @classmethod
+    @lru_cache(maxsize=32)  # the same 'module:function' string recurs across Settings instances - import_module once
+    def _resolve_callable_from_string(cls, callable_string: str) -> Callable:
         errors = []
         for callable_string_alt in callable_string.split('|'):
             if ':' not in callable_string_alt:
@@ -149,8 +169,11 @@ class Arguments:
                 raise AttributeError(f"Module '{module_name}' has no attribute '{func_name}'")
         raise ModuleNotFoundError(f"Could not resolve callable from {callable_string!r}: {'; '.join(errors)}")
 
-    @classmethod
-    def from_argv(cls, argv: Sequence[str] | None = None):
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _make_parser() -> argparse.ArgumentParser:
+        """ArgumentParser assembly is surprisingly costly - build it once,\n
+        for library callers invoking from_argv/from_str repeatedly"""
         parser = argparse.ArgumentParser()
         parser.add_argument('-S', '--section')
         parser.add_argument('-P', '--profile')
@@ -174,7 +197,11 @@ class Arguments:
         output_gr.add_argument('-j', '--json', action='store_const', dest='output', const='json')
         output_gr.add_argument('-J', '--ndjson', action='store_const', dest='output', const='ndjson')
         parser.add_argument('-p', '--local-path', help='Run logrep on local file(s)')
-        args = parser.parse_args(argv)
+        return parser
+
+    @classmethod
+    def from_argv(cls, argv: Sequence[str] | None = None):
+        args = cls._make_parser().parse_args(argv)
         profile_to_settings = load_config()
         try:
             settings = profile_to_settings[args.section or TOP_LEVEL]
@@ -251,17 +278,21 @@ def make_profile_to_settings_from_toml_text(toml_str) -> ProfileToSettings:
             key = key.replace('-', '_')
             common_kwargs_for_settings[key] = value
     for section, dct in profile_to_dict.items():
-        kwargs_for_settings = common_kwargs_for_settings.copy()
-        kwargs_for_settings['section'] = section
-        for key, value in dct.items():
-            kwargs_for_settings[key] = value
-        profile_to_settings[section] = Settings(**kwargs_for_settings)
+        # one C-level dict merge instead of copy() plus a Python-level overlay loop
+        profile_to_settings[section] = Settings(**common_kwargs_for_settings | dct | {'section': section})
     return profile_to_settings
 
 
+@lru_cache(maxsize=4)
+def _load_config_cached(path_str: str, mtime_ns: int) -> ProfileToSettings:
+    """mtime_ns keys the cache - an edited config re-parses, an unchanged one is free"""
+    return make_profile_to_settings_from_toml_path(Path(path_str))
+
+
 def load_config():
+    toml_file = me.with_suffix('.toml')
     try:
-        return make_profile_to_settings_from_toml_path(me.with_suffix('.toml'))
+        return _load_config_cached(str(toml_file), toml_file.stat().st_mtime_ns)
     except FileNotFoundError:
         return {TOP_LEVEL: Settings()}
 
@@ -271,11 +302,13 @@ class HeaderTemplate:
 
     def __init__(self, template: str):
         self._template = template
+        self._args = None
+        self._command_prefix = None
 
     def format(self, a: Arguments, file_name: str, datefmt: str = '%Y-%m-%d %H:%M:%SZ', tz: timezone = timezone.utc):
-        dct = {
-            'asctime': a.template_processor(datetime.now(tz).strftime(datefmt)),
-            'command': a.template_processor(' '.join(e for e in [
+        if a is not self._args:  # everything but file_name is invariant per Arguments - assemble it once per grep run
+            self._args = a
+            self._command_prefix = ' '.join(e for e in [
                 self.NAME,
                 '-n' if a.line_number is not None else '',
                 f"--discard-before={a.discard_before!r}" if a.discard_before else '',
@@ -285,12 +318,20 @@ class HeaderTemplate:
                 f"-e {a.pattern!r}",
                 f"--except-pattern={a.except_pattern!r}" if a.except_pattern else '',
                 '-l' if a.files_with_matches else '',
-                f"{file_name!r}",
-            ] if e))
+            ] if e)
+        dct = {
+            'asctime': a.template_processor(datetime.now(tz).strftime(datefmt)),
+            'command': a.template_processor(f"{self._command_prefix} {file_name!r}"),
         }
         return self._template.format_map(dct)
 
 
+@lru_cache(maxsize=32)
+def _header_template(template: str) -> HeaderTemplate:
+    """One HeaderTemplate per template string, instead of a fresh instance per file header"""
+    return HeaderTemplate(template)
+
+
 class RecordType:
     file_path = 'l'
     discard_before = 'D'
@@ -300,44 +341,98 @@ class RecordType:
     discard_after = 'd'
 
 
+class BufferedLineSink:
+    """A file-like wrapper which batches written text and forwards it via writelines,\n
+    amortizing the per-print stdout lock/flush when many records are emitted"""
+
+    def __init__(self, target, every: int = 512, max_chars: int = 65536):
+        self._target = target
+        try:
+            is_tty = target.isatty()
+        except AttributeError:  # e.g. a StringIO-like or custom sink
+            is_tty = False
+        self._every = 1 if is_tty else every  # on a terminal, forward per line to keep output interactive
+        self._max_chars = max_chars  # flush on volume too, so a few very long lines don't pile up in memory
+        self._buf = []
+        self._size = 0
+
+    def write(self, text):
+        self._buf.append(text)
+        self._size += len(text)
+        if len(self._buf) >= self._every or self._size >= self._max_chars:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            self._target.writelines(self._buf)
+            self._buf.clear()
+            self._size = 0
+        self._target.flush()
+
+
 def grep(argv=None, a: Arguments = None, out=None):
     a = a or Arguments.from_argv(argv)
     pattern_rx, pattern_str = _parse_pattern_and_init_colorama(a)
+    sink = BufferedLineSink(out or sys.stdout)
     prev_num = 0
     template_open = False
-    for line_num, record_type, line in iter_records(argv, a):
-        prev_num, template_open = _grep_record(line_num, record_type, line, pattern_rx, pattern_str, a, prev_num, template_open, out)
-    print_footer_if_required(template_open, a, out)
+    try:
+        for line_num, record_type, line in iter_records(argv, a):
+            prev_num, template_open = _grep_record(line_num, record_type, line, pattern_rx, pattern_str, a, prev_num, template_open, sink)
+        print_footer_if_required(template_open, a, sink)
+    finally:
+        sink.flush()
+
+
+@lru_cache(maxsize=128)
+def _compile_match_strategy(pattern: str) -> tuple[str | None, re.Pattern | None]:
+    """Decides literal vs regex matching in a single scan of the pattern.\n
+    Returns (pattern_str, pattern_rx) - exactly one of them is not None"""
+    parts = []
+    last_end = 0
+    for m in RX_COMPLEX_OR_ESCAPE.finditer(pattern):
+        if m.lastgroup == 'complex':
+            return None, _compile_pattern(pattern)
+        parts.append(pattern[last_end:m.start()])  # drop the escape - the char after it is matched literally
+        last_end = m.end()
+    return (''.join(parts) + pattern[last_end:]) if parts else pattern, None
+
+
+_colorama_initialized = False
 
 
 def _parse_pattern_and_init_colorama(a: Arguments | None) -> tuple[re.Pattern, str]:
+    global _colorama_initialized
     pattern_str = pattern_rx = None
     if a.use_color and a.pattern:
-        init()  # colorama
-        if is_probably_complex_pattern(a.pattern):
-            pattern_rx = re.compile(a.pattern)
-        else:
-            pattern_str = RX_ESCAPE_FOLLOWED_BY_SPECIAL.sub('', a.pattern)
+        if not _colorama_initialized:  # init() re-scans env vars and re-wraps the streams on every call
+            init()  # colorama
+            _colorama_initialized = True
+        pattern_str, pattern_rx = _compile_match_strategy(a.pattern)
     return pattern_rx, pattern_str
 
 
+# color fragments used per record, bound once - colorama's Fore/Style attribute lookups are not free in a hot loop
+_GREEN = Fore.GREEN
+_LIGHTYELLOW = Fore.LIGHTYELLOW_EX
+_RESET_ALL = Style.RESET_ALL
+_GREEN_GAP_SEP = f"{Fore.GREEN}--{Fore.RESET}"
+
+
 def _grep_record(line_num: int, record_type: str, line: str, pattern_rx: re.Pattern | None, pattern_str: str | None, a: Arguments, prev_num: int, template_open: bool, out=None):
     if line_num == 0 and record_type == RecordType.file_path and a.header_template:
         print_footer_if_required(template_open, a, out)
-        file_name = Path(line).name
-        msg = HeaderTemplate(a.header_template).format(a, file_name=file_name)
-        print(f"{Fore.LIGHTYELLOW_EX}{msg}{Style.RESET_ALL}" if a.use_color else f"{msg}", file=out)
+        file_name = os.path.basename(line)  # no PurePath construction just to take the tail
+        msg = _header_template(a.header_template).format(a, file_name=file_name)
+        print(f"{_LIGHTYELLOW}{msg}{_RESET_ALL}" if a.use_color else f"{msg}", file=out)
         template_open = True
         prev_num = 0
     else:
         sep = ':' if record_type == RecordType.pattern else '-'
         if prev_num and prev_num + 1 != line_num:
-            if a.use_color:
-                print(f"{Fore.GREEN}--{Fore.RESET}", file=out)
-            else:
-                print('--', file=out)
+            print(_GREEN_GAP_SEP if a.use_color else '--', file=out)
         if a.use_color:
-            colored_num_sep = f"{Fore.GREEN}{line_num}{sep}{Style.RESET_ALL}" if a.line_number else ''
+            colored_num_sep = f"{_GREEN}{line_num}{sep}{_RESET_ALL}" if a.line_number else ''
             _line_ = make_colored_line(line, pattern_str, pattern_rx) if record_type == RecordType.pattern else line
             print(f"{colored_num_sep}{_line_}", file=out)
         else:
@@ -365,25 +460,56 @@ def iter_records_parsed_from_ndjsons(ndjsons_iterator: Iterator[str]):
         if not list_as_ndjson:
             continue
         try:
-            yield from json.loads(list_as_ndjson)
-        except json.JSONDecodeError:
+            yield from _json_loads(list_as_ndjson)
+        except ValueError:  # covers json.JSONDecodeError and orjson.JSONDecodeError
             print(list_as_ndjson, file=sys.stderr)
             print(sys.exc_info(), file=sys.stderr)
             continue
 
 
+_session: requests.Session | None = None
+
+
+def get_session() -> requests.Session:
+    """Lazily creates the shared Session - import stays cheap,\n
+    and pooled TCP+TLS connections survive across fetches"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        # allowed_methods=None retries POST too - the search POST is read-only, and it is the only request this client makes
+        retries = requests.adapters.Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=None)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+        atexit.register(_session.close)
+    return _session
+
+
 def fetch_and_iter_ndjsons(argv=None, a: Arguments = None):
     """Iterates over NDJSONs fetched from logrep_server"""
-    yield from fetch_resp(argv, a).iter_lines()
+    resp = fetch_resp(argv, a)
+    try:
+        # split raw 64 KiB chunks on newlines - skips the iter_lines state machine and its per-line allocations
+        buf = bytearray()
+        for chunk in resp.raw.stream(65536, decode_content=True):
+            buf += chunk
+            while (idx := buf.find(b'\n')) != -1:
+                yield bytes(buf[:idx])
+                del buf[:idx + 1]
+        if buf:
+            yield bytes(buf)
+    finally:
+        # a drained body is released back to the pool; an early generator close tears the socket down cleanly
+        resp.close()
 
 
 def fetch_resp(argv=None, a: Arguments = None):
     a = a or Arguments.from_argv(argv)
     url_with_query = f"{a.url}{a.url_query}"
     a.verbose and print(f"{Fore.CYAN}{url_with_query}\n{a.search_args}{Style.RESET_ALL}" if a.use_color else url_with_query, file=sys.stderr)
-    headers = {'Accept-Encoding': 'identity' if a.identity else 'zstd'}
+    headers = {'Accept-Encoding': 'identity' if a.identity else 'zstd, gzip', 'Connection': 'keep-alive'}  # gzip as a fallback for servers without zstd
     try:
-        resp = requests.post(a.url, verify=a.verify, headers=headers, json=a.search_args, stream=True)
+        resp = get_session().post(a.url, verify=a.verify, headers=headers, json=a.search_args, stream=True)
     except requests.ConnectionError as e:
         et = type(e)
         print(f"{et.__module__}.{et.__qualname__}: {e}", file=sys.stderr)
@@ -402,11 +528,25 @@ def print_footer_if_required(template_open: bool, a: Arguments, out=None):
         print(f"{Fore.LIGHTYELLOW_EX}{msg}{Style.RESET_ALL}" if a.use_color else f"{msg}", file=out)
 
 
+_BRIGHT_RED = f"{Style.BRIGHT}{Fore.RED}"
+_HIGHLIGHT_REPL = f"{_BRIGHT_RED}\\g<0>{Style.RESET_ALL}"
+
+
+@lru_cache(maxsize=128)
+def _literal_highlight(pattern_str: str) -> str:
+    """The replacement string is invariant per pattern - format it once, not per line"""
+    return f"{_BRIGHT_RED}{pattern_str}{_RESET_ALL}"
+
+
 def make_colored_line(line: str, pattern_str: str | None, pattern_rx: re.Pattern | None) -> str:
     if pattern_str:
-        colored_line = line.replace(pattern_str, f"{Style.BRIGHT}{Fore.RED}{pattern_str}{Style.RESET_ALL}")
+        colored_line = line.replace(pattern_str, _literal_highlight(pattern_str))
     elif pattern_rx:
-        colored_line = ''.join(f"{Style.BRIGHT}{Fore.RED}{text}{Style.RESET_ALL}" if is_match else text for is_match, text in gen_segments_with_is_match(line, pattern_rx))
+        if pattern_rx.groups <= 1:
+            # whole-match highlighting stays in the C sre engine; only multi-group patterns need the Python segmenter
+            colored_line = pattern_rx.sub(_HIGHLIGHT_REPL, line)
+        else:
+            colored_line = ''.join(f"{_BRIGHT_RED}{text}{_RESET_ALL}" if is_match else text for is_match, text in gen_segments_with_is_match(line, pattern_rx))
     else:
         colored_line = line
     return colored_line
@@ -436,29 +576,26 @@ def gen_segments_with_is_match(line: str, pattern: re.Pattern) -> Generator[tupl
     else:
         ## Handle non-alternative groups
         for m in matches:
+            ## m.regs holds all (start, end) spans in one tuple - no per-group start()/end()/group() C-API calls
+            regs = m.regs
+            full_start, full_end = regs[0]
             ## 1. Handle the prefix (unmatched text before the full match)
-            prefix_end = m.start(0)
-            if prefix_end > 0:
-                yield False, line[0:prefix_end]
+            if full_start > 0:
+                yield False, line[0:full_start]
             ## 2. Iterate through all captured groups and the text between them
-            current_pos = m.start(0)
-            for g in range(1, len(m.groups()) + 1):
-                group_start = m.start(g)
-                group_end = m.end(g)
-                group_text = m.group(g)
+            current_pos = full_start
+            for group_start, group_end in regs[1:]:
                 ## A. Handle the UNMATCHED text between the last position and the current group's start
                 if group_start > current_pos:
-                    unmatched_text = line[current_pos:group_start]
-                    yield False, unmatched_text
-                ## B. Handle the CAPTURED GROUP text (is_match = True)
-                if group_text is not None:
-                    yield True, group_text
+                    yield False, line[current_pos:group_start]
+                ## B. Handle the CAPTURED GROUP text (is_match = True); (-1, -1) marks a non-participating group
+                if group_start != -1:
+                    yield True, line[group_start:group_end]
                 ## Update the current position to the end of the current group
                 current_pos = group_end
             ## 3. Handle the suffix (unmatched text after the full match)
-            suffix_start = m.end(0)
-            if suffix_start < len(line):
-                yield False, line[suffix_start:len(line)]
+            if full_end < len(line):
+                yield False, line[full_end:len(line)]
 
 
 def grep_local_path(a: Arguments, out=None):
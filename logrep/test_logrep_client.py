@@ -1,6 +1,73 @@
+import io
 import re
 
-from logrep.logrep_client import gen_segments_with_is_match, Arguments
+from logrep.logrep_client import gen_segments_with_is_match, Arguments, BufferedLineSink, _compile_match_strategy
+
+
+class TtyStringIO(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_buffered_line_sink__batches_until_flush():
+    target = io.StringIO()
+    sink = BufferedLineSink(target, every=3)
+    sink.write('a\n')
+    sink.write('b\n')
+    assert target.getvalue() == ''
+    sink.flush()
+    assert target.getvalue() == 'a\nb\n'
+
+
+def test_buffered_line_sink__flushes_at_line_threshold():
+    target = io.StringIO()
+    sink = BufferedLineSink(target, every=2)
+    sink.write('a\n')
+    assert target.getvalue() == ''
+    sink.write('b\n')
+    assert target.getvalue() == 'a\nb\n'
+
+
+def test_buffered_line_sink__flushes_at_volume_cap():
+    target = io.StringIO()
+    sink = BufferedLineSink(target, every=512, max_chars=8)
+    sink.write('123456789\n')
+    assert target.getvalue() == '123456789\n'
+
+
+def test_buffered_line_sink__tty_target_gets_each_line():
+    target = TtyStringIO()
+    sink = BufferedLineSink(target, every=512)
+    sink.write('a\n')
+    assert target.getvalue() == 'a\n'
+
+
+def test_compile_match_strategy__plain_text_is_literal():
+    assert _compile_match_strategy('plain text') == ('plain text', None)
+
+
+def test_compile_match_strategy__escaped_special_is_literal_unescaped():
+    assert _compile_match_strategy(r'5\.') == ('5.', None)
+
+
+def test_compile_match_strategy__multiple_escaped_specials():
+    assert _compile_match_strategy(r'a\.b\*c') == ('a.b*c', None)
+
+
+def test_compile_match_strategy__escaped_backslash_before_special():
+    assert _compile_match_strategy(r'\\(') == (r'\(', None)
+
+
+def test_compile_match_strategy__special_char_is_regex():
+    pattern_str, pattern_rx = _compile_match_strategy('a.*b')
+    assert pattern_str is None
+    assert pattern_rx.pattern == 'a.*b'
+
+
+def test_compile_match_strategy__escape_class_is_regex():
+    pattern_str, pattern_rx = _compile_match_strategy(r'\d+')
+    assert pattern_str is None
+    assert pattern_rx.pattern == r'\d+'
 
 
 def test_gen_segments_with_is_match__two_segments_with_nonmatching_between():